@@ -12,12 +12,19 @@ RAW_PATTERN = os.sep.join(['{root}', '{date}', '{device_id}', '{device_type}', '
 
 # PROCESSED_PATTERN example: processed_root/setup_2/mounted_rgb/0000_0000_1_1.mp4
 SESSION_ID = '{subject_id}_{ith_day}_{start_ts}_{end_ts}'
-PROCESSED_PATTERN = os.sep.join(['{root}', 'setup_{setup_id}', '{data_type}', SESSION_ID])
+PROCESSED_FOLDER_PATTERN = os.sep.join(['{root}', 'setup_{setup_id}', '{data_type}'])
+PROCESSED_PATTERN = os.sep.join([PROCESSED_FOLDER_PATTERN, SESSION_ID])
 
 # ELAN_PATTERN example: elan_root/setup_6/0000_0000_1_1/0000_0000_1_1_wrist_inertia.elan
 ELAN_FOLDER_PATTERN = os.sep.join(['{root}', 'setup_{setup_id}', '{session_id}'])
 ELAN_FILE_PATTERN = os.sep.join(['{elan_folder}', '{session_id}'])
 
+# cache of raw files' start & end timestamps, saved in raw root folder
+TS_CACHE_FILENAME = '.ts_cache.json'
+# version of the cached timestamps, bump it whenever start & end timestamp extraction changes (e.g. video duration,
+# ms rounding) so that caches written by older code are discarded
+TS_CACHE_VERSION = 1
+
 # raw camera filename with extension
 CAMERA_FILENAME_PATTERN = 'TimeVideo_%Y%m%d_%H%M%S.%f.mp4'
 
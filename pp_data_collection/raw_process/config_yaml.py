@@ -1,5 +1,11 @@
 import yaml
 
+try:
+    # C-backed loader, only available if PyYAML is built with libyaml
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 from pp_data_collection.constants import CFG_FILE_EXTENSION, DeviceType
 
 
@@ -53,7 +59,7 @@ class Config:
         Load and validate config file
         """
         with open(self.yaml_file, 'r') as F:
-            cfg = yaml.safe_load(F)
+            cfg = yaml.load(F, Loader=SafeLoader)
 
         # verify params
         assert isinstance(cfg['max_time_gap'], int), f"a 'max_time_gap' integer must be defined"
@@ -1,21 +1,46 @@
 from __future__ import annotations
 
 from abc import ABC
-from typing import Type, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Type, Union, List
 import numpy as np
 import os
+import threading
 from datetime import datetime
+from functools import lru_cache
 import pandas as pd
 from loguru import logger
 
 from pp_data_collection.raw_process.config_yaml import Config
-from pp_data_collection.utils.dataframe import interpolate_numeric_df, read_df_file, write_df_file
+from pp_data_collection.utils.dataframe import read_df_file, write_df_file, read_csv_pyarrow
+from pp_data_collection.utils.number_array import interpolate_numeric_array
 from pp_data_collection.utils.time import datetime_2_timestamp
 from pp_data_collection.utils.video import ffmpeg_cut_video
 from pp_data_collection.constants import CAMERA_FILENAME_PATTERN, InertialColumn, TimerAppColumn, SensorLoggerConst, \
-    DeviceType, G_TO_MS2
-from pp_data_collection.utils.text_file import read_last_line
-from pp_data_collection.utils.video import get_video_metadata
+    DeviceType, G_TO_MS2, CFG_FILE_EXTENSION
+from pp_data_collection.utils.text_file import read_last_line, read_head_and_tail
+from pp_data_collection.utils.video import get_video_duration
+
+
+@lru_cache(maxsize=4096)
+def parse_camera_filename(filename: str) -> datetime:
+    """
+    Parse start datetime from a raw camera filename (see CAMERA_FILENAME_PATTERN), e.g. TimeVideo_20220709_113327.07.mp4
+    The fixed-width fields are sliced directly, `datetime.strptime` is only used for names that don't fit this layout.
+
+    Args:
+        filename: video filename (without folder)
+
+    Returns:
+        a datetime object
+    """
+    frac = filename[26:-4]
+    if (len(filename) > 30 and filename.startswith('TimeVideo_') and filename.endswith('.mp4')
+            and filename[18] == '_' and filename[25] == '.' and filename[10:18].isdigit()
+            and filename[19:25].isdigit() and frac.isdigit() and len(frac) <= 6):
+        return datetime(int(filename[10:14]), int(filename[14:16]), int(filename[16:18]),
+                        int(filename[19:21]), int(filename[21:23]), int(filename[23:25]), int(frac.ljust(6, '0')))
+    return datetime.strptime(filename, CAMERA_FILENAME_PATTERN)
 
 
 class RecordingDevice:
@@ -31,6 +56,8 @@ class RecordingDevice:
             config: config read from config/cfg.yaml
         """
         self.config = config
+        # read once here because `check_output_path` is called for every output file
+        self.output_format = self.config.device_cfg[self.name][CFG_FILE_EXTENSION]
 
     def get_start_end_timestamp_w_offset(self, path: str, offset: int) -> tuple:
         """
@@ -73,12 +100,41 @@ class RecordingDevice:
         output_path = self._trim_data_with_offset(data, output_path, start_ts, end_ts)
         return output_path
 
+    def trim_raw_batch(self, input_path: str, output_paths: List[str], start_end_tss: List[list],
+                       offset: int) -> List[Union[str, None]]:
+        """
+        Same as `trim_raw`, but trim many segments (e.g. sub-sessions) of the same raw file,
+        the raw file is read only once for all segments.
+
+        Args:
+            input_path: path to raw sensor file, timestamps of data in file are without offset
+            output_paths: paths to save output files, one for each segment
+            start_end_tss: start & end timestamps in millisecond of each segment (with offset already added),
+                example: [[start ts, end ts], [start ts, end ts], ...]
+            offset: time offset in millisecond, this value will be added to raw start/end timestamp
+
+        Returns:
+            a list of output paths, an item is None if `trim` of that segment is not successful
+        """
+        assert len(output_paths) == len(start_end_tss), 'Number of output paths and segments must be the same'
+        output_paths = [self.check_output_path(output_path) for output_path in output_paths]
+        if not any(output_paths):
+            return output_paths
+
+        logger.info(f'Processing {input_path}')
+        data = self._read_raw_data(input_path)
+        data = self._add_offset_to_data(data, offset)
+        return [
+            self._trim_data_with_offset(data, output_path, start_ts, end_ts) if output_path else None
+            for output_path, (start_ts, end_ts) in zip(output_paths, start_end_tss)
+        ]
+
     def check_output_path(self, output_path: str) -> Union[str, None]:
         """
         Verify output_path:
             - add file extension, then
-            - check if file already exists
-        This method should be called at the beginning of `trim` method.
+            - check if file already exists (an empty file left by an interrupted run is removed and not counted)
+        This method should be called at the beginning of `trim` method, so existing outputs are not processed again.
 
         Args:
             output_path: output path in `trim` method
@@ -86,10 +142,13 @@ class RecordingDevice:
         Returns:
             if file already exists, return None; else, return output path with extension added
         """
-        output_path += self.config.device_cfg[self.name]['output_format']
+        output_path += self.output_format
         if os.path.exists(output_path):
-            logger.info(f'This file already exists: {output_path}')
-            return None
+            if os.path.getsize(output_path) > 0:
+                logger.info(f'This file already exists: {output_path}')
+                return None
+            logger.warning(f'Removing empty output file: {output_path}')
+            os.remove(output_path)
         return output_path
 
     @staticmethod
@@ -212,16 +271,31 @@ class TimestampCamera(RecordingDevice):
     Example name: TimeVideo_20220709_113327.07.mp4
     """
 
+    def __init__(self, config: Config):
+        super().__init__(config)
+        # start & end timestamps (without offset) of each video path; they are needed when finding session bounds and
+        # again when trimming, so filename parsing and video probing are only done once per file
+        self.start_end_ts_cache = {}
+
     def _split_interrupted_ts(self, file_path: str) -> Union[list, None]:
         return None
 
     def _get_start_end_timestamp_wo_offset(self, path: str) -> tuple:
+        start_end_ts = self.start_end_ts_cache.get(path)
+        if start_end_ts is None:
+            start_end_ts = self.start_end_ts_cache[path] = self._compute_start_end_timestamp_wo_offset(path)
+        return start_end_ts
+
+    def _compute_start_end_timestamp_wo_offset(self, path: str) -> tuple:
+        """
+        Same as `_get_start_end_timestamp_wo_offset` but without caching.
+        """
         # get video start time
-        vid_start_datetime = datetime.strptime(os.path.split(path)[1], CAMERA_FILENAME_PATTERN)
+        vid_start_datetime = parse_camera_filename(os.path.split(path)[1])
         vid_start_timestamp = datetime_2_timestamp(vid_start_datetime, tz=self.config.data_timezone)
 
         # calculate video end time
-        vid_end_timestamp = vid_start_timestamp + round(get_video_metadata(path)['length'] * 1000)
+        vid_end_timestamp = vid_start_timestamp + round(get_video_duration(path) * 1000)
 
         return vid_start_timestamp, vid_end_timestamp
 
@@ -293,8 +367,8 @@ class TimerApp(RecordingDevice):
             first_line = f.readline()
         last_line = read_last_line(path)
         # extract timestamps
-        start_ts = int(first_line.split(',')[1])
-        end_ts = int(last_line.split(',')[2])
+        start_ts = int(first_line.split(',', 2)[1])
+        end_ts = int(last_line.split(',', 3)[2])
 
         return start_ts, end_ts
 
@@ -335,6 +409,62 @@ class InertialSensor(RecordingDevice, ABC):
     Base class for all inertial sensor classes
     """
 
+    def __init__(self, config: Config):
+        super().__init__(config)
+
+        # sampling rate in Hz (sample/s)
+        self.sampling_rate = self.config.device_cfg[self.name]['sampling_rate']
+        self.round_digits = self.config.device_cfg[self.name]['round_digits']
+
+        assert 1000 % self.sampling_rate == 0, \
+            "1000 must be divisible by sampling rate to make sure that timestamp (ms) is an integer"
+
+        # interval between 2 resampled timestamps (ms)
+        self.step_ms = 1000 // self.sampling_rate
+
+        # cached offsets [0, step_ms, 2*step_ms, ...] of resampled timestamps, grown when a longer session comes
+        self.ts_grid_cache = np.empty(0, dtype=np.int64)
+        # reusable output buffer of interpolation (one per thread), grown when a longer session comes
+        self.thread_local = threading.local()
+
+    def _get_output_buffer(self, num_rows: int, num_cols: int) -> np.ndarray:
+        """
+        Get a float64 array to hold interpolated data of a session. The array is a view of a buffer owned by this
+        object and the calling thread, so it is only valid until the next call of this method in the same thread.
+
+        Args:
+            num_rows: number of rows
+            num_cols: number of columns
+
+        Returns:
+            a C-contiguous array of shape [num_rows, num_cols] with undefined values
+        """
+        buffer = getattr(self.thread_local, 'output_buffer', None)
+        capacity, buffer_cols = (0, 0) if buffer is None else buffer.shape
+        if capacity < num_rows or buffer_cols != num_cols:
+            # grow by doubling to avoid re-allocating for every slightly longer session
+            buffer = self.thread_local.output_buffer = np.empty([max(num_rows, capacity * 2), num_cols],
+                                                                dtype=np.float64)
+        return buffer[:num_rows]
+
+    def _get_new_ts(self, start_ts: int, end_ts: int) -> np.ndarray:
+        """
+        Get resampled timestamp array of a session. Timestamp offsets are cached and reused across files.
+
+        Args:
+            start_ts: session start timestamp (ms)
+            end_ts: session end timestamp (ms)
+
+        Returns:
+            1D int64 array [start_ts, start_ts + step_ms, ...], last element <= end_ts
+        """
+        num_ts = (end_ts - start_ts) // self.step_ms + 1
+        # local reference because another thread may replace the cache in the meantime
+        ts_grid = self.ts_grid_cache
+        if len(ts_grid) < num_ts:
+            ts_grid = self.ts_grid_cache = np.arange(num_ts, dtype=np.int64) * self.step_ms
+        return ts_grid[:num_ts] + start_ts
+
     def _split_interrupted_ts(self, file_path: str) -> [list, None]:
         # find timestamp gaps in file
         ts = self._get_raw_ts_array(file_path)
@@ -379,37 +509,25 @@ class Watch(InertialSensor):
         gyroscope z (rad/s)
     """
 
-    def __init__(self, config: Config):
-        super().__init__(config)
-
-        # convert from Hz (sample/s) to sample/ms
-        self.sampling_rate = self.config.device_cfg[self.name]['sampling_rate']
-        self.round_digits = self.config.device_cfg[self.name]['round_digits']
-
-        assert 1000 % self.sampling_rate == 0, \
-            "1000 must be divisible by sampling rate to make sure that timestamp (ms) is an integer"
-
-        self.sampling_rate /= 1000
-
     def _get_start_end_timestamp_wo_offset(self, path: str) -> tuple:
         # read first and last line of file
-        with open(path) as f:
-            first_line = f.readline()
-        last_line = read_last_line(path)
+        (first_line,), last_line = read_head_and_tail(path)
         # extract timestamps
-        start_ts = int(first_line.split(',')[0])
-        end_ts = int(last_line.split(',')[0])
+        start_ts = int(first_line.split(b',', 1)[0])
+        end_ts = int(last_line.split(b',', 1)[0])
 
         return start_ts, end_ts
 
     def _read_raw_data(self, input_path: str) -> any:
+        # pandas tolerates a recording cut off mid-row (missing values become NaN), pyarrow's reader doesn't
         df = read_df_file(input_path, header=None)
         df.columns = InertialColumn.to_list()
         return df
 
     def _get_raw_ts_array(self, input_path: str) -> np.ndarray:
-        data = self._read_raw_data(input_path)
-        ts = data[InertialColumn.TIMESTAMP.value].to_numpy()
+        # only read the timestamp column, the whole recording is not needed here
+        df = read_df_file(input_path, usecols=[0], header=None)
+        ts = df.iloc[:, 0].to_numpy()
         return ts
 
     def _add_offset_to_data(self, data: any, offset: int) -> any:
@@ -419,13 +537,19 @@ class Watch(InertialSensor):
 
     def _trim_data_with_offset(self, data: any, output_path: str, start_ts: int, end_ts: int) -> Union[str, None]:
         # create new timestamp array from session's start and end timestamp
-        new_ts = np.arange(np.floor((end_ts - start_ts) * self.sampling_rate + 1)
-                           ) / self.sampling_rate + start_ts
-        new_ts = new_ts.astype(int)
-        # interpolate
-        data = interpolate_numeric_df(data, timestamp_col=InertialColumn.TIMESTAMP.value, new_timestamp=new_ts)
+        new_ts = self._get_new_ts(start_ts, end_ts)
+        # interpolate all channels at once
+        value_cols = InertialColumn.to_list()[1:]
+        arr = interpolate_numeric_array(data[InertialColumn.TIMESTAMP.value].to_numpy(),
+                                        data[value_cols].to_numpy(), new_ts,
+                                        out=self._get_output_buffer(len(new_ts), len(value_cols)))
+        # round in place, the interpolated array is not shared with the input data
         if self.round_digits is not None:
-            data = data.round(self.round_digits)
+            np.round(arr, self.round_digits, out=arr)
+
+        # only create DF right before writing
+        data = pd.DataFrame(arr, columns=value_cols, copy=False)
+        data.insert(loc=0, column=InertialColumn.TIMESTAMP.value, value=new_ts)
         write_df_file(data, output_path)
         return output_path
 
@@ -442,58 +566,77 @@ class PhoneSensorLogger(InertialSensor):
     def __init__(self, config: Config):
         super().__init__(config)
 
-        # convert from Hz (sample/s) to sample/ms
-        self.sampling_rate = self.config.device_cfg[self.name]['sampling_rate']
-        self.round_digits = self.config.device_cfg[self.name]['round_digits']
-
-        assert 1000 % self.sampling_rate == 0, \
-            "1000 must be divisible by sampling rate to make sure that timestamp (ms) is an integer"
-
-        self.sampling_rate /= 1000
-
         self.RAW_TS_COL: str = SensorLoggerConst.RAW_TS_COL.value
         self.RAW_DATA_COLS: list = SensorLoggerConst.RAW_DATA_COLS.value
         self.ACCE_FILENAME = SensorLoggerConst.ACCE_FILENAME.value
         self.GYRO_FILENAME = SensorLoggerConst.GYRO_FILENAME.value
 
+    def _get_gyro_acce_paths(self, path: str) -> tuple:
+        """
+        Get paths of gyro and acce files in a SensorLogger data folder.
+
+        Args:
+            path: path to SensorLogger data folder
+
+        Returns:
+            a tuple of 2 paths: gyro file, acce file
+        """
+        return f'{path}{os.sep}{self.GYRO_FILENAME}', f'{path}{os.sep}{self.ACCE_FILENAME}'
+
     def _get_start_end_timestamp_wo_offset(self, path: str) -> tuple:
         first_ts = -1
         last_ts = float('inf')
 
-        for filename in [self.GYRO_FILENAME, self.ACCE_FILENAME]:
-            filepath = os.sep.join([path, filename])
-            # read first and last line of file
-            with open(filepath) as f:
-                file_first_line = f.readline()
-                assert file_first_line.split(',')[0] == self.RAW_TS_COL
-                file_first_line = f.readline()
-            file_last_line = read_last_line(filepath)
+        for filepath in self._get_gyro_acce_paths(path):
+            # read header, first and last line of file
+            (file_header, file_first_line), file_last_line = read_head_and_tail(filepath, num_head_lines=2)
+            assert file_header.split(b',', 1)[0].decode() == self.RAW_TS_COL
             # extract timestamp, convert from nanosecond to millisecond
-            file_first_msec = round(int(file_first_line.split(',')[0]) / 1e6)
-            file_last_msec = round(int(file_last_line.split(',')[0]) / 1e6)
+            file_first_msec = round(int(file_first_line.split(b',', 1)[0]) / 1e6)
+            file_last_msec = round(int(file_last_line.split(b',', 1)[0]) / 1e6)
             # get overlapping range of all modalities
             first_ts = max(first_ts, file_first_msec)
             last_ts = min(last_ts, file_last_msec)
         return first_ts, last_ts
 
     def _read_raw_data(self, input_path: str) -> any:
+        """
+        Read raw gyro and acce data. Timestamps are converted to millisecond; acce is converted from g to m/s^2.
+
+        Args:
+            input_path: path to SensorLogger data folder
+
+        Returns:
+            a tuple of 2 DFs: gyro, acce
+        """
         # read DF raw data files
         use_cols = [self.RAW_TS_COL] + self.RAW_DATA_COLS
-        gyro_df = read_df_file(os.sep.join([input_path, self.GYRO_FILENAME]), usecols=use_cols)
-        acce_df = read_df_file(os.sep.join([input_path, self.ACCE_FILENAME]), usecols=use_cols)
+        dtypes = {self.RAW_TS_COL: np.int64, **{col: np.float64 for col in self.RAW_DATA_COLS}}
+        # 2 files are independent, read them concurrently;
+        # pyarrow's reader is used because it skips parsing of unused columns
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            gyro_future, acce_future = [
+                executor.submit(read_csv_pyarrow, filepath, usecols=use_cols, dtype=dtypes)
+                for filepath in self._get_gyro_acce_paths(input_path)
+            ]
+            gyro_df = gyro_future.result()
+            acce_df = acce_future.result()
 
         # convert g to m/s^2
         acce_df[self.RAW_DATA_COLS] *= G_TO_MS2
 
         # convert timestamp nanosec -> millisec
-        gyro_df[self.RAW_TS_COL] = (gyro_df[self.RAW_TS_COL] / 1e6).round().astype(int)
-        acce_df[self.RAW_TS_COL] = (acce_df[self.RAW_TS_COL] / 1e6).round().astype(int)
+        gyro_df[self.RAW_TS_COL] = (gyro_df[self.RAW_TS_COL] / 1e6).round().astype(np.int64)
+        acce_df[self.RAW_TS_COL] = (acce_df[self.RAW_TS_COL] / 1e6).round().astype(np.int64)
 
         return gyro_df, acce_df
 
     def _get_raw_ts_array(self, input_path: str) -> np.ndarray:
-        data = self._read_raw_data(input_path)
-        ts = data[0][SensorLoggerConst.RAW_TS_COL.value].to_numpy()
+        # only read the timestamp column of gyro file, the whole recording is not needed here
+        df = read_csv_pyarrow(f'{input_path}{os.sep}{self.GYRO_FILENAME}', usecols=[self.RAW_TS_COL],
+                              dtype={self.RAW_TS_COL: np.int64})
+        # convert timestamp nanosec -> millisec
+        ts = (df[self.RAW_TS_COL].to_numpy() / 1e6).round().astype(np.int64)
         return ts
 
     def _add_offset_to_data(self, data: any, offset: int) -> any:
@@ -510,19 +653,24 @@ class PhoneSensorLogger(InertialSensor):
     def _trim_data_with_offset(self, data: any, output_path: str, start_ts: int, end_ts: int) -> Union[str, None]:
         gyro_df, acce_df = data
 
-        # interpolate
-        new_ts = np.arange(np.floor((end_ts - start_ts) * self.sampling_rate + 1)
-                           ) / self.sampling_rate + start_ts
-        new_ts = new_ts.astype(int)
-        gyro_df = interpolate_numeric_df(gyro_df, timestamp_col=self.RAW_TS_COL, new_timestamp=new_ts)
-        acce_df = interpolate_numeric_df(acce_df, timestamp_col=self.RAW_TS_COL, new_timestamp=new_ts)
-
-        # concat gyro and acce
-        df = pd.concat([acce_df, gyro_df[self.RAW_DATA_COLS]], axis=1, ignore_index=True)
-        df.columns = InertialColumn.to_list()
+        # interpolate acce and gyro directly into 1 output array
+        new_ts = self._get_new_ts(start_ts, end_ts)
+        num_cols = len(self.RAW_DATA_COLS)
+        arr = self._get_output_buffer(len(new_ts), num_cols * 2)
+        # acce channels are taken in raw file order (z, y, x) like previous versions of this pipeline,
+        # so output columns acc_x and acc_z hold raw z and x respectively.
+        # This is kept so that outputs stay consistent with already processed data; fixing the axis order
+        # requires regenerating (or versioning) all processed phone data and must be done as a separate change.
+        interpolate_numeric_array(acce_df[self.RAW_TS_COL].to_numpy(), acce_df[self.RAW_DATA_COLS[::-1]].to_numpy(),
+                                  new_ts, out=arr[:, :num_cols])
+        interpolate_numeric_array(gyro_df[self.RAW_TS_COL].to_numpy(), gyro_df[self.RAW_DATA_COLS].to_numpy(),
+                                  new_ts, out=arr[:, num_cols:])
 
         if self.round_digits is not None:
-            df = df.round(self.round_digits)
+            np.round(arr, self.round_digits, out=arr)
 
+        # only create DF right before writing
+        df = pd.DataFrame(arr, columns=InertialColumn.to_list()[1:], copy=False)
+        df.insert(loc=0, column=InertialColumn.TIMESTAMP.value, value=new_ts)
         write_df_file(df, output_path)
         return output_path
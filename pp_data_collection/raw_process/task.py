@@ -1,21 +1,27 @@
-from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Tuple, List, Iterator
+import json
 import numpy as np
 import os
-from glob import glob
+import sys
+import threading
 import pandas as pd
-from datetime import datetime, timedelta
 from loguru import logger
 
-from pp_data_collection.constants import LogColumn, PROCESSED_PATTERN, RAW_PATTERN, DeviceType
+from pp_data_collection.constants import LogColumn, PROCESSED_FOLDER_PATTERN, SESSION_ID, DeviceType, \
+    TS_CACHE_FILENAME, TS_CACHE_VERSION
 from pp_data_collection.raw_process.config_yaml import Config
 from pp_data_collection.raw_process.log_excel import CollectionLog
 from pp_data_collection.raw_process.recording_device import RecordingDevice
 from pp_data_collection.utils.number_array import interval_intersection
-from pp_data_collection.utils.time import datetime_2_timestamp
+from pp_data_collection.utils.text_file import read_all_text
+from pp_data_collection.utils.time import datetimes_2_timestamps
 
 
 class Task:
-    def __init__(self, device_config_file: str, log_file: str, raw_data_folder: str, processed_data_folder: str):
+    def __init__(self, device_config_file: str, log_file: str, raw_data_folder: str, processed_data_folder: str,
+                 num_workers: int = 1):
         """
         A class for raw data handling:
             - pre-process raw data (if applicable)
@@ -28,26 +34,166 @@ class Task:
             log_file: path to the data collection log file (excel)
             raw_data_folder: folder containing raw data from recording devices, see RAW_PATTERN for more details
             processed_data_folder: folder to save processed data
+            num_workers: number of threads to trim data files of different sessions concurrently
         """
+        assert num_workers >= 1, 'num_workers must be a positive integer'
         self.log_file = log_file
         self.raw_folder = raw_data_folder
         self.processed_folder = processed_data_folder
+        self.num_workers = num_workers
         # column name to add to log df, this represents ordinal number of collection day of each subject
         self.ITH_DAY = 'ith_day'
+        # column names to add to log df, these are logged start & end timestamps (msec) of each session
+        self.LOG_START_TS = 'log_start_ts'
+        self.LOG_END_TS = 'log_end_ts'
+        # column name to add to log df, this is the date without slashes (folder name in raw data folder)
+        self.DATE_FOLDER = 'date_folder'
 
         # read config
-        cfg_obj = Config(device_config_file).load()
-        self.data_timezone = cfg_obj.data_timezone
+        self.config = Config(device_config_file).load()
+        self.data_timezone = self.config.data_timezone
 
-        # initialise sensor objects
+        # sensor objects, only initialised when a sensor type is used (see `get_sensor_object`)
         self.sensor_objects: Dict[str, RecordingDevice] = {}
-        for sensor_type, sensor_param in cfg_obj.device_cfg.items():
-            self.sensor_objects[sensor_type] = RecordingDevice.get_sensor_class(sensor_type)(cfg_obj)
+        self.sensor_objects_lock = threading.Lock()
+
+        # index of raw data files, key is (date, device ID, device type),
+        # value is (list of paths, start & end timestamps array); see `build_file_index`
+        self.file_index: Dict[Tuple[str, str, str], Tuple[List[str], np.ndarray]] = {}
+        # output folders already created in this run
+        self.made_dirs = set()
+        # results of `split_interrupted_ts` of each raw file, a file may be shared by many sessions
+        self.split_ts_cache = {}
+        # sessions are trimmed in multiple threads, this lock guards `made_dirs` and `split_ts_cache`
+        self.session_state_lock = threading.Lock()
+
+    def get_sensor_object(self, sensor_type: str) -> RecordingDevice:
+        """
+        Get the sensor object of a sensor type, initialise it at the first call.
+
+        Args:
+            sensor_type: sensor type assigned to each sensor by decorator `device_type`
+
+        Returns:
+            sensor object
+        """
+        sensor_object = self.sensor_objects.get(sensor_type)
+        if sensor_object is None:
+            # lock because this may be called from multiple threads
+            with self.sensor_objects_lock:
+                sensor_object = self.sensor_objects.get(sensor_type)
+                if sensor_object is None:
+                    sensor_object = RecordingDevice.get_sensor_class(sensor_type)(self.config)
+                    self.sensor_objects[sensor_type] = sensor_object
+        return sensor_object
+
+    @staticmethod
+    def get_path_signature(path: str) -> list:
+        """
+        Get modification time and size of a raw data path to detect changes.
+        If the path is a folder (e.g. SensorLogger), its direct child files are taken into account.
+
+        Args:
+            path: path to a data file or folder
+
+        Returns:
+            a list of 2 integers: modification time (nanosecond), size (byte)
+        """
+        stat = os.stat(path)
+        if not os.path.isdir(path):
+            return [stat.st_mtime_ns, stat.st_size]
+
+        mtime = stat.st_mtime_ns
+        size = 0
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file():
+                    entry_stat = entry.stat()
+                    mtime = max(mtime, entry_stat.st_mtime_ns)
+                    size += entry_stat.st_size
+        return [mtime, size]
+
+    def _load_ts_cache(self) -> dict:
+        """
+        Load the cache of raw start & end timestamps (without offset) from the raw data folder.
+        The cache is discarded if it was created with a different data timezone or cache version (TS_CACHE_VERSION).
+
+        Returns:
+            a dict with key - path to data file; value - [mtime, size, start timestamp, end timestamp]
+        """
+        cache_path = os.path.join(self.raw_folder, TS_CACHE_FILENAME)
+        if not os.path.isfile(cache_path):
+            return {}
+        try:
+            cache = json.loads(read_all_text(cache_path))
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            logger.warning(f'Ignoring broken timestamp cache file: {cache_path}')
+            return {}
+        # a valid JSON file may still have an unexpected format (e.g. written by an older version)
+        if not (isinstance(cache, dict) and isinstance(cache.get('files'), dict)):
+            logger.warning(f'Ignoring timestamp cache file with unexpected format: {cache_path}')
+            return {}
+        if cache.get('version') != TS_CACHE_VERSION:
+            logger.info(f'Discarding timestamp cache file of another version: {cache_path}')
+            return {}
+        if cache.get('data_timezone') != self.data_timezone:
+            return {}
+        return cache['files']
+
+    def _save_ts_cache(self, ts_cache: dict) -> None:
+        """
+        Save the cache of raw start & end timestamps (without offset) to the raw data folder.
+        The cache is only an optimisation, so failing to write it does not stop the pipeline. It is written to a
+        temporary file first, so an interrupted run doesn't leave a truncated cache file.
+
+        Args:
+            ts_cache: a dict with key - path to data file; value - [mtime, size, start timestamp, end timestamp]
+        """
+        cache_path = os.path.join(self.raw_folder, TS_CACHE_FILENAME)
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        content = json.dumps({'version': TS_CACHE_VERSION, 'data_timezone': self.data_timezone, 'files': ts_cache})
+        try:
+            with open(temp_path, 'w') as F:
+                F.write(content)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f'Cannot save timestamp cache file {cache_path}: {e}')
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def walk_raw_folder(self, dates: list) -> Iterator[Tuple[str, str, str, str]]:
+        """
+        Find all raw data files (or folders) of some collection dates, following RAW_PATTERN.
+        Hidden files and folders (starting with a dot) are skipped.
+
+        Args:
+            dates: list of dates without slashes (folder names in raw data folder)
+
+        Yields:
+            tuples of 4 elements: path to data file, date, device ID, device type
+        """
+        for date in dates:
+            date_folder = os.sep.join([self.raw_folder, date])
+            if not os.path.isdir(date_folder):
+                continue
+            with os.scandir(date_folder) as device_id_entries:
+                for device_id_entry in device_id_entries:
+                    if device_id_entry.name.startswith('.') or not device_id_entry.is_dir():
+                        continue
+                    with os.scandir(device_id_entry.path) as device_type_entries:
+                        for device_type_entry in device_type_entries:
+                            if device_type_entry.name.startswith('.') or not device_type_entry.is_dir():
+                                continue
+                            with os.scandir(device_type_entry.path) as data_file_entries:
+                                for data_file_entry in data_file_entries:
+                                    if not data_file_entry.name.startswith('.'):
+                                        yield data_file_entry.path, date, device_id_entry.name, device_type_entry.name
 
     def get_all_start_end_timestamps(self, log_df: pd.DataFrame,
                                      day_offset_dict: dict) -> Dict[str, Tuple[int, int]]:
         """
-        Get start and end timestamps (msec) with offsets of all data files
+        Get start and end timestamps (msec) with offsets of all data files.
+        This also builds `self.file_index` from the found files (see `build_file_index`).
 
         Args:
             log_df: collection log dataframe following format in LogColumn
@@ -64,91 +210,137 @@ class Task:
         for key in list(day_offset_dict):
             day_offset_dict[key.replace('/', '')] = day_offset_dict.pop(key)
 
-        # find all data files using information in log_df
-        data_files = []
-        for date in list_date:
-            data_files += glob(
-                RAW_PATTERN.format(root=self.raw_folder, date=date, device_id='*', device_type='*', data_file='*')
-            )
-        # read timestamps of all data files
-        all_start_end_tss = {}
-        # for each file
-        for data_file in data_files:
-            # get its sensor type name
-            date, device_id, sensor_type = [data_file.split(os.sep)[i] for i in [-4, -3, -2]]
+        # read timestamps of all data files, raw files don't change so timestamps of previous runs are reused
+        ts_cache = self._load_ts_cache()
+        # list of tuples (data file, date, device ID, sensor type)
+        file_infos = []
+        # files that are not in cache or have changed, (data file, sensor type, path signature)
+        uncached_files = []
+        # for each data file of the dates in log_df
+        for data_file, date, device_id, sensor_type in self.walk_raw_folder(list_date):
             if sensor_type in RecordingDevice.__sub_sensor_names__:
-                # get start and end timestamps with offset added
-                offset = day_offset_dict[date][device_id]
-                logger.info(f'Day offset for {data_file} is: {offset} msec')
-                all_start_end_tss[data_file] = self.sensor_objects[sensor_type].get_start_end_timestamp_w_offset(
-                    data_file, offset)
-        return all_start_end_tss
-
-    def find_data_files_of_session(self, log_df_row: pd.Series, all_files_start_end_tss: dict) -> pd.DataFrame:
+                file_infos.append((data_file, date, device_id, sensor_type))
+                signature = self.get_path_signature(data_file)
+                cached_item = ts_cache.get(data_file)
+                if cached_item is None or cached_item[:2] != signature:
+                    uncached_files.append((data_file, sensor_type, signature))
+
+        # get start and end timestamps without offset of uncached files,
+        # files are independent and reading them is mostly I/O or ffprobe, so threads are enough
+        def get_ts_wo_offset(item: tuple) -> tuple:
+            path, sensor_type_, _ = item
+            return self.get_sensor_object(sensor_type_).get_start_end_timestamp_w_offset(path, 0)
+
+        if uncached_files:
+            with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+                for (data_file, _, signature), (start_ts, end_ts) in \
+                        zip(uncached_files, executor.map(get_ts_wo_offset, uncached_files)):
+                    ts_cache[data_file] = signature + [int(start_ts), int(end_ts)]
+
+        # only keep files found in this run, so entries of deleted files don't pile up
+        num_cached_files = len(ts_cache)
+        ts_cache = {file_info[0]: ts_cache[file_info[0]] for file_info in file_infos}
+        if uncached_files or len(ts_cache) != num_cached_files:
+            self._save_ts_cache(ts_cache)
+
+        # add offset, timestamps of all files are kept in 1 array (same order as file_infos)
+        offsets = []
+        num_files_per_date = {}
+        for data_file, date, device_id, sensor_type in file_infos:
+            offset = day_offset_dict[date][device_id]
+            # message is only formatted if DEBUG level is enabled
+            logger.debug('Day offset for {} is: {} msec', data_file, offset)
+            offsets.append(offset)
+            num_files_per_date[date] = num_files_per_date.get(date, 0) + 1
+        for date, num_files in num_files_per_date.items():
+            logger.info(f'Day offsets applied to {num_files} data files of {date}')
+        all_start_end_tss = np.array([ts_cache[file_info[0]][2:] for file_info in file_infos],
+                                     dtype=np.int64).reshape([-1, 2])
+        all_start_end_tss += np.array(offsets, dtype=np.int64).reshape([-1, 1])
+
+        self.file_index = self.build_file_index(file_infos, all_start_end_tss)
+        return dict(zip([file_info[0] for file_info in file_infos], map(tuple, all_start_end_tss.tolist())))
+
+    @staticmethod
+    def build_file_index(file_infos: list, all_start_end_tss: np.ndarray) \
+            -> Dict[Tuple[str, str, str], Tuple[List[str], np.ndarray]]:
+        """
+        Group raw data files by date, device ID and device type, so that files of a sensor on a day can be found
+        without scanning the raw folder again, and their timestamps are already in an array for matching.
+
+        Args:
+            file_infos: list of tuples (path to data file, date, device ID, device type), as yielded by
+                `walk_raw_folder`
+            all_start_end_tss: int64 array shape [number of files, 2(start ts, end ts)], already with offset,
+                rows are in the same order as `file_infos`
+
+        Returns:
+            a dict with key - tuple (date without slashes, device ID, device type);
+                value - tuple (list of paths, int64 array shape [number of paths, 2(start ts, end ts)])
+        """
+        grouped_rows = {}
+        for row_idx, (path, date, device_id, device_type) in enumerate(file_infos):
+            grouped_rows.setdefault((date, device_id, device_type), []).append(row_idx)
+
+        file_index = {
+            key: ([file_infos[row_idx][0] for row_idx in row_idxs], all_start_end_tss[row_idxs])
+            for key, row_idxs in grouped_rows.items()
+        }
+        return file_index
+
+    def find_data_files_of_session(self, log_df_row: dict) -> pd.DataFrame:
         """
         This method finds all data files (of all devices and data types) in a session.
+        Files are looked up in `self.file_index`, which is built by `get_all_start_end_timestamps`.
 
         Args:
-            log_df_row: a row of a session in log file (log file columns are in pp_data_collection.constants.LogColumn)
-            all_files_start_end_tss: a dictionary with
-                key - absolute path to data file;
-                value - a tuple of 2 elements (start timestamp, end timestamp), already with offset
+            log_df_row: a row of a session in log file as a dict, key is column name
+                (log file columns are in pp_data_collection.constants.LogColumn)
 
         Returns:
             a DF with columns [device_type, device_id, data_type, start_ts, end_ts, file_path],
                 time columns are after offset
         """
         # get session info
-        date, start_time, end_time = log_df_row.loc[[
-            LogColumn.DATE.value,
-            LogColumn.START_TIME.value,
-            LogColumn.END_TIME.value
-        ]]
-        start_dt = datetime.strptime(f'{date} {start_time}', '%Y/%m/%d %H:%M:%S')
-        end_dt = datetime.strptime(f'{date} {end_time}', '%Y/%m/%d %H:%M:%S')
-        date = date.replace('/', '')
-        # check if this session passed midnight
-        if start_dt > end_dt:
-            end_dt += timedelta(days=1)
-            logger.warning(f'Midnight session detected, please make sure it is not a logging mistake.')
-        # convert log start/end times to timestamps (reshape for later operation with a 2D array)
-        log_start_end_ts = np.array([datetime_2_timestamp(start_dt, self.data_timezone),
-                                     datetime_2_timestamp(end_dt, self.data_timezone)]).reshape([1, 2])
+        date = log_df_row[self.DATE_FOLDER]
+        # log start/end timestamps (reshape for later operation with a 2D array)
+        log_start_end_ts = np.array([log_df_row[self.LOG_START_TS],
+                                     log_df_row[self.LOG_END_TS]]).reshape([1, 2])
 
         result_df = []
         # for each sensor in a session
-        for col_name, device_id in log_df_row.loc[LogColumn.SENSOR_COLS.value].items():
+        for col_name in LogColumn.SENSOR_COLS.value:
+            device_id = log_df_row[col_name]
             # skip unused sensors
             if pd.isna(device_id):
                 continue
             # get info from log file
-            data_type, device_type = col_name.split(' ')
+            # (interned because they are repeated in every session)
+            data_type, device_type = map(sys.intern, col_name.split(' '))
 
             # find data file belonging to this session
             # get paths to data files that have the required device ID, device type and collection date
-            pattern = RAW_PATTERN.format(root=self.raw_folder, date=date, device_id=device_id,
-                                         device_type=device_type, data_file='*')
-            file_paths = glob(pattern)
-            # get start and end times of data files
-            # numpy array shape [number of files, 2(start ts, end ts)]
-            sensor_start_end_tss = np.array([all_files_start_end_tss[path] for path in file_paths])
+            # and their start and end times, numpy array shape [number of files, 2(start ts, end ts)]
+            file_paths, sensor_start_end_tss = self.file_index.get((date, str(device_id), device_type),
+                                                                   ([], np.empty([0, 2], dtype=np.int64)))
+            assert len(file_paths) > 0, f'No data file found for device {device_id} ({device_type}) on {date}'
             # find which file belongs to this session by finding the nearest start/end timestamp to logged timestamp
-            diff = np.abs(sensor_start_end_tss - log_start_end_ts)
-            sensor_idx = np.argmin(diff.sum(axis=1))
-            diff = diff[sensor_idx] / 1000
+            # (usually a device has only 1 file per day, then there's nothing to search)
+            if len(file_paths) == 1:
+                sensor_idx = 0
+            else:
+                diff = sensor_start_end_tss - log_start_end_ts
+                sensor_idx = np.argmin(np.abs(diff[:, 0]) + np.abs(diff[:, 1]))
+            # the matched file must still be close enough to the logged timestamps
+            diff = np.abs(sensor_start_end_tss[sensor_idx] - log_start_end_ts[0]) / 1000
             logger.info(f'Difference: {diff}(second); Matched file: {file_paths[sensor_idx]}')
             assert np.all(diff < 180), 'Matched file has too big difference gap from logged timestamp'
 
-            result_df.append({
-                'device_type': device_type,
-                'device_id': device_id,
-                'data_type': data_type,
-                'start_ts': sensor_start_end_tss[sensor_idx][0],
-                'end_ts': sensor_start_end_tss[sensor_idx][1],
-                'file_path': file_paths[sensor_idx]
-            })
+            start_ts, end_ts = sensor_start_end_tss[sensor_idx]
+            result_df.append((device_type, device_id, data_type, start_ts, end_ts, file_paths[sensor_idx]))
 
-        result_df = pd.DataFrame.from_records(result_df)
+        result_df = pd.DataFrame(result_df,
+                                 columns=['device_type', 'device_id', 'data_type', 'start_ts', 'end_ts', 'file_path'])
         return result_df
 
     def find_start_end_ts_of_session(self, session_df: pd.DataFrame) -> list:
@@ -168,8 +360,16 @@ class Task:
         df = session_df.loc[session_df['device_type'] != DeviceType.TIMER_APP.value]
 
         all_sensor_ts_segments = []
-        for _, (device_type, device_id, data_type, start_ts, end_ts, file_path) in df.iterrows():
-            interrupted_ts_segments = self.sensor_objects[device_type].split_interrupted_ts(file_path)
+        for device_type, device_id, data_type, start_ts, end_ts, file_path in df.itertuples(index=False, name=None):
+            with self.session_state_lock:
+                is_cached = file_path in self.split_ts_cache
+                interrupted_ts_segments = self.split_ts_cache.get(file_path)
+            if not is_cached:
+                # computed without holding the lock, so other sessions are not blocked while the file is read;
+                # 2 sessions sharing a file may both compute it, with the same result
+                interrupted_ts_segments = self.get_sensor_object(device_type).split_interrupted_ts(file_path)
+                with self.session_state_lock:
+                    self.split_ts_cache[file_path] = interrupted_ts_segments
             if interrupted_ts_segments is None:
                 interrupted_ts_segments = [[start_ts, end_ts]]
             all_sensor_ts_segments.append(interrupted_ts_segments)
@@ -196,26 +396,31 @@ class Task:
         # find sensors intersection range
         subsessions_ts = self.find_start_end_ts_of_session(session_df)
 
+        # output file names (without extension) are the same for all sensors, only format them once per sub-session
+        session_ids = [SESSION_ID.format(subject_id=subject_id, ith_day=ith_day, start_ts=start_ts, end_ts=end_ts)
+                       for start_ts, end_ts in subsessions_ts]
+
         num_processed_files = 0
         # for each sensor file
-        for _, (device_type, device_id, data_type, file_path) in \
-                session_df[['device_type', 'device_id', 'data_type', 'file_path']].iterrows():
+        for device_type, device_id, data_type, file_path in \
+                session_df[['device_type', 'device_id', 'data_type', 'file_path']].itertuples(index=False, name=None):
             saved_file = False
-            # for each sub-session
-            for subsession_ts in subsessions_ts:
-                subsession_start_ts, subsession_end_ts = subsession_ts
-
-                output_path = PROCESSED_PATTERN.format(root=self.processed_folder,
-                                                       setup_id=setup_id,
-                                                       data_type=data_type,
-                                                       subject_id=subject_id,
-                                                       ith_day=ith_day,
-                                                       start_ts=subsession_start_ts,
-                                                       end_ts=subsession_end_ts)
-                os.makedirs(os.path.split(output_path)[0], exist_ok=True)
-                trimmed_path = self.sensor_objects[device_type].trim_raw(
-                    file_path, output_path, subsession_start_ts, subsession_end_ts, session_offset_dict[device_id]
-                )
+            # output folder is the same for all sub-sessions
+            output_dir = PROCESSED_FOLDER_PATTERN.format(root=self.processed_folder,
+                                                         setup_id=setup_id,
+                                                         data_type=data_type)
+            if subsessions_ts:
+                with self.session_state_lock:
+                    if output_dir not in self.made_dirs:
+                        os.makedirs(output_dir, exist_ok=True)
+                        self.made_dirs.add(output_dir)
+            # same as PROCESSED_PATTERN
+            output_paths = [os.sep.join([output_dir, session_id]) for session_id in session_ids]
+            # trim all sub-sessions at once so the raw file is only read once
+            trimmed_paths = self.get_sensor_object(device_type).trim_raw_batch(
+                file_path, output_paths, subsessions_ts, session_offset_dict[device_id]
+            )
+            for trimmed_path in trimmed_paths:
                 if trimmed_path:
                     logger.info(f"Saved to '{trimmed_path}'")
                     saved_file = True
@@ -227,6 +432,48 @@ class Task:
 
         return num_processed_files
 
+    def add_date_folder(self, log_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add a column of dates without slashes, which are folder names in raw data folder.
+        Each unique date is only reformatted once.
+
+        Args:
+            log_df: collection log dataframe following format in LogColumn
+
+        Returns:
+            the same dataframe with an added column DATE_FOLDER
+        """
+        date_col = log_df[LogColumn.DATE.value]
+        log_df[self.DATE_FOLDER] = date_col.map({date: date.replace('/', '') for date in date_col.unique()})
+        return log_df
+
+    def add_log_timestamps(self, log_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add 2 columns of logged start & end timestamps (msec) of each session. All rows are converted at once.
+        If a session's end time is before its start time, the session is considered passing midnight.
+
+        Args:
+            log_df: collection log dataframe following format in LogColumn
+
+        Returns:
+            the same dataframe with 2 added columns LOG_START_TS and LOG_END_TS
+        """
+        dates = log_df[LogColumn.DATE.value].astype(str) + ' '
+        start_dt = pd.to_datetime(dates + log_df[LogColumn.START_TIME.value].astype(str), format='%Y/%m/%d %H:%M:%S')
+        end_dt = pd.to_datetime(dates + log_df[LogColumn.END_TIME.value].astype(str), format='%Y/%m/%d %H:%M:%S')
+
+        # check if sessions passed midnight
+        midnight_sessions = start_dt > end_dt
+        if midnight_sessions.any():
+            end_dt = end_dt.mask(midnight_sessions, end_dt + pd.Timedelta(days=1))
+            logger.warning(f'Midnight session detected at row(s) {log_df.index[midnight_sessions].to_list()}, '
+                           f'please make sure it is not a logging mistake.')
+
+        # convert to timestamps, datetime values are in data timezone
+        log_df[self.LOG_START_TS] = datetimes_2_timestamps(start_dt, tz=self.data_timezone)
+        log_df[self.LOG_END_TS] = datetimes_2_timestamps(end_dt, tz=self.data_timezone)
+        return log_df
+
     def count_day_subject(self, log_df: pd.DataFrame) -> pd.DataFrame:
         """
         Add a column showing ordinal number of collection day of each subject.
@@ -237,13 +484,8 @@ class Task:
         Returns:
             the same dataframe with an added column "ith_day"
         """
-
-        def apply_func(df: pd.DataFrame) -> pd.DataFrame:
-            df[self.ITH_DAY] = df[LogColumn.DATE.value].rank(method='dense').astype(int)
-            return df
-
-        log_df = log_df.groupby(LogColumn.SUBJECT.value)
-        log_df = log_df.apply(apply_func)
+        log_df[self.ITH_DAY] = log_df.groupby(LogColumn.SUBJECT.value)[LogColumn.DATE.value] \
+            .rank(method='dense').astype(np.int32)
         return log_df
 
     def run(self) -> None:
@@ -256,39 +498,81 @@ class Task:
 
         # add ordinal number of collection day for each subject
         log_df = self.count_day_subject(log_df)
+        # convert logged start & end times of all sessions to timestamps
+        log_df = self.add_log_timestamps(log_df)
+        log_df = self.add_date_folder(log_df)
 
         # get start and end timestamps of all data files, this will only be used for session-data_files matching
         all_files_start_end_tss = self.get_all_start_end_timestamps(log_df, day_offset_dict)
         logger.info(f"Get start & end timestamps of all data files, number of files: {len(all_files_start_end_tss)}")
 
-        files_matched = []
+        files_matched = set()
         num_processed_sessions = 0
         num_processed_raw_files = 0
-        # for each session
-        for row_name, row in log_df.iterrows():
-            # get info of this session
-            session_no = row.at[LogColumn.SESSION.value]
-            setup_id = row.at[LogColumn.SETUP.value]
-            subject_id = row.at[LogColumn.SUBJECT.value]
-            ith_day = row.at[self.ITH_DAY]
-            logger.info(f"Processing session number {session_no} at row {row_name} of log file")
-
-            # find all data files of this session
-            session_df = self.find_data_files_of_session(row, all_files_start_end_tss)
-            files_matched += session_df['file_path'].to_list()
-            logger.info(f"This session has {len(session_df)} data files")
-
-            # trim data files
-            num_new_files = self.trim_data_files_of_session(
-                session_df, session_offset_dict[session_no], setup_id, subject_id, ith_day
-            )
-            if num_new_files:
-                num_processed_raw_files += num_new_files
-                num_processed_sessions += 1
+        # sessions have separate output files, so they are trimmed concurrently
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            # submitted sessions in log file order, items are tuples (future, session number, row name in log file)
+            trim_futures = []
+            # set as soon as a session fails, so that no more sessions are submitted
+            trim_failed = threading.Event()
+
+            def on_trim_done(future, session_idx: int):
+                if (not future.cancelled()) and (future.exception() is not None):
+                    trim_failed.set()
+                    # like sequential processing, sessions after the failed one are not processed
+                    for later_future, _, _ in trim_futures[session_idx + 1:]:
+                        later_future.cancel()
+
+            submit_error = None
+            try:
+                # for each session
+                for row_name, row in zip(log_df.index, log_df.to_dict('records')):
+                    if trim_failed.is_set():
+                        break
+                    # get info of this session
+                    session_no = row[LogColumn.SESSION.value]
+                    setup_id = row[LogColumn.SETUP.value]
+                    subject_id = row[LogColumn.SUBJECT.value]
+                    ith_day = row[self.ITH_DAY]
+                    logger.info(f"Processing session number {session_no} at row {row_name} of log file")
+
+                    # find all data files of this session
+                    session_df = self.find_data_files_of_session(row)
+                    files_matched.update(session_df['file_path'].to_numpy())
+                    logger.info(f"This session has {len(session_df)} data files")
+
+                    # trim data files
+                    future = executor.submit(
+                        self.trim_data_files_of_session,
+                        session_df, session_offset_dict[session_no], setup_id, subject_id, ith_day
+                    )
+                    trim_futures.append((future, session_no, row_name))
+                    future.add_done_callback(partial(on_trim_done, session_idx=len(trim_futures) - 1))
+            except KeyboardInterrupt:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+            except Exception as e:
+                # sessions submitted before this one are still finished before raising, like sequential processing
+                submit_error = e
+
+            # collect results in log file order, so the first failed session is found after all sessions before it
+            for session_idx, (future, session_no, row_name) in enumerate(trim_futures):
+                exception = future.exception()
+                if exception is not None:
+                    logger.error(f'Failed to process session number {session_no} at row {row_name} of log file, '
+                                 f'its output files may be incomplete')
+                    for later_future, _, _ in trim_futures[session_idx + 1:]:
+                        later_future.cancel()
+                    raise exception
+                num_new_files = future.result()
+                if num_new_files:
+                    num_processed_raw_files += num_new_files
+                    num_processed_sessions += 1
+            if submit_error is not None:
+                raise submit_error
 
         # just double check if all found files matched to a session
-        files_matched = set(files_matched)
-        files_scanned = set(all_files_start_end_tss.keys())
+        files_scanned = all_files_start_end_tss.keys()
         if files_scanned != files_matched:
             logger.warning(f"Mismatched files:\n" + '\n'.join(sorted(files_scanned - files_matched)))
         # print statistics
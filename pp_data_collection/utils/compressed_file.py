@@ -1,19 +1,23 @@
 import zipfile
 import os
-from typing import Union
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List
 from loguru import logger
 
 
 def unzip_file(zip_path: str, destination_folder: str = None, extract_to_name: bool = True,
-               del_zip: bool = False) -> Union[str, None]:
+               del_zip: bool = False, num_workers: int = None) -> Union[str, None]:
     """
-    Extract a zip file.
+    Extract a zip file. Members are extracted by multiple threads, each thread has its own file handle.
+    Members that already exist in the destination folder with the same size are not extracted again.
     Args:
         zip_path: path to zip file
         destination_folder: folder to save output, default: same folder as input
         extract_to_name: whether to create a new folder with the same name as the zip file and extract into it,
         if False, save directly to destination_folder
         del_zip: whether to delete zip file after extraction
+        num_workers: number of extracting threads, default: number of CPUs
 
     Returns:
         path to extracted folder if successful, None otherwise
@@ -30,7 +34,29 @@ def unzip_file(zip_path: str, destination_folder: str = None, extract_to_name: b
     # extract
     try:
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(destination_folder)
+            members = zip_ref.infolist()
+
+        # create all folders first so that threads don't race to create the same folder
+        for member in members:
+            os.makedirs(os.path.join(destination_folder, _get_member_folder(member)), exist_ok=True)
+        # skip files already extracted (by a previous run)
+        file_members = [member for member in members
+                        if not (member.is_dir() or _is_extracted(member, destination_folder))]
+        if not file_members:
+            logger.info(f'All files are already extracted from {zip_path}')
+
+        num_workers = min(num_workers or os.cpu_count() or 1, len(file_members))
+        if num_workers > 1:
+            # distribute members to threads, zlib releases the GIL while decompressing
+            member_groups = [file_members[i::num_workers] for i in range(num_workers)]
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = [executor.submit(_extract_members, zip_path, group, destination_folder)
+                           for group in member_groups]
+                for future in futures:
+                    future.result()
+        elif num_workers == 1:
+            _extract_members(zip_path, file_members, destination_folder)
+
         # delete zip file
         if del_zip:
             os.remove(zip_path)
@@ -38,3 +64,109 @@ def unzip_file(zip_path: str, destination_folder: str = None, extract_to_name: b
         logger.error(f'error at file: {zip_path} - {e}')
 
     return destination_folder
+
+
+def _get_member_path(member: zipfile.ZipInfo) -> str:
+    """
+    Get the relative path that a zip member is extracted to, path is sanitised like in `ZipFile.extract`.
+
+    Args:
+        member: zip member info
+
+    Returns:
+        relative path of the extracted file/folder
+    """
+    arcname = member.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    return os.path.sep.join(part for part in arcname.split(os.path.sep)
+                            if part not in ('', os.path.curdir, os.path.pardir))
+
+
+def _get_member_folder(member: zipfile.ZipInfo) -> str:
+    """
+    Get the relative folder that a zip member is extracted into.
+
+    Args:
+        member: zip member info
+
+    Returns:
+        relative path of the folder, empty string if the member is at the root of the archive
+    """
+    member_path = _get_member_path(member)
+    # a folder member is a folder itself, a file member is in its parent folder
+    return member_path if member.is_dir() else os.path.dirname(member_path)
+
+
+def _is_extracted(member: zipfile.ZipInfo, destination_folder: str) -> bool:
+    """
+    Check if a zip file member already exists in the destination folder with the same size.
+
+    Args:
+        member: zip member info
+        destination_folder: folder to save output
+
+    Returns:
+        a boolean
+    """
+    output_path = os.path.join(destination_folder, _get_member_path(member))
+    return os.path.isfile(output_path) and os.path.getsize(output_path) == member.file_size
+
+
+def _copy_stored_member(zip_file, member: zipfile.ZipInfo, output_path: str) -> bool:
+    """
+    Copy an uncompressed (STORED) zip member to a file using `os.copy_file_range`, so data is copied inside the
+    kernel without going through Python. CRC is not verified in this case.
+
+    Args:
+        zip_file: binary file object of the zip file
+        member: zip member info, must be STORED and not encrypted
+        output_path: path to save output
+
+    Returns:
+        True if successful; False if copy_file_range is not supported (nothing is written)
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    # data starts after the local file header, whose name & extra field lengths may differ from the central directory
+    zip_file.seek(member.header_offset)
+    local_header = zip_file.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+    data_offset = member.header_offset + zipfile.sizeFileHeader + name_len + extra_len
+
+    with open(output_path, 'wb') as output_file:
+        remaining = member.file_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(zip_file.fileno(), output_file.fileno(), remaining,
+                                            offset_src=data_offset + member.file_size - remaining)
+                if copied == 0:
+                    raise OSError('Unexpected end of zip file')
+                remaining -= copied
+        except OSError:
+            if remaining < member.file_size:
+                raise
+            # not supported by the file systems, nothing is written yet
+            output_file.close()
+            os.remove(output_path)
+            return False
+    return True
+
+
+def _extract_members(zip_path: str, members: List[zipfile.ZipInfo], destination_folder: str) -> None:
+    """
+    Extract some members of a zip file using a separate file handle.
+    Uncompressed members are copied directly with `os.copy_file_range` if possible.
+
+    Args:
+        zip_path: path to zip file
+        members: list of members to extract
+        destination_folder: folder to save output
+    """
+    with open(zip_path, 'rb') as zip_file, zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in members:
+            if (member.compress_type == zipfile.ZIP_STORED) and not (member.flag_bits & 0x1) and \
+                    _copy_stored_member(zip_file, member, os.path.join(destination_folder, _get_member_path(member))):
+                continue
+            zip_ref.extract(member, destination_folder)
@@ -2,39 +2,80 @@ import os
 from typing import Union, Dict
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from loguru import logger
 
+from pp_data_collection.utils.number_array import interpolate_numeric_array
 
-def read_df_file(path: str, usecols: list = None, force_column_order: bool = True,
+# max number of rows per row group in written parquet files, so big files can be read in parts
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+
+
+def read_df_file(path: str, usecols: list = None, force_column_order: bool = True, row_groups: list = None,
                  **kwargs) -> Union[pd.DataFrame, Dict[str, pd.DataFrame]]:
     """
-    This function reads a file into a DataFrame object. Supported formats are: parquet, csv, xls, xlsx.
+    This function reads a file into a DataFrame object. Supported formats are: parquet, csv, csv.gz, xls, xlsx.
 
     Args:
         path: path to file
         usecols: list of columns to read
         force_column_order: column order must be like in `usecols`
+        row_groups: (parquet only) indices of row groups to read, default: all
         kwargs: keyword arguments for pandas' reading function
 
     Returns:
         a DataFrame
     """
-    if path.endswith('csv'):
+    if path.endswith(('csv', 'csv.gz')):
         df = pd.read_csv(path, usecols=usecols, **kwargs)
     elif path.endswith('parquet'):
-        df = pd.read_parquet(path, columns=usecols, **kwargs)
+        if row_groups is not None:
+            # read only some parts of a big file
+            df = pq.ParquetFile(path).read_row_groups(row_groups, columns=usecols).to_pandas()
+        else:
+            # pyarrow decodes columns in multiple threads
+            kwargs.setdefault('engine', 'pyarrow')
+            df = pd.read_parquet(path, columns=usecols, **kwargs)
     elif path.endswith('xlsx') or path.endswith('xls'):
         df = pd.read_excel(path, usecols=usecols, **kwargs)
         if force_column_order and usecols:
             df = df[usecols]
     else:
-        raise ValueError('only supports parquet, csv, xls, xlsx')
+        raise ValueError('only supports parquet, csv, csv.gz, xls, xlsx')
     return df
 
 
+def read_csv_pyarrow(path: str, usecols: list, dtype: dict = None) -> pd.DataFrame:
+    """
+    Read some columns of a CSV file using pyarrow's multithreaded reader. Columns not in `usecols` are not parsed.
+    Type inference and empty field (NA) handling are pyarrow's, not the same as `pd.read_csv`; this is meant for
+    well-formed numeric files such as raw sensor data.
+
+    Args:
+        path: path to file
+        usecols: list of column names to read
+        dtype: dict with keys are column names, values are numpy dtypes; if given, type inference is skipped for
+            these columns
+
+    Returns:
+        a DataFrame with columns in the same order as `usecols`
+    """
+    column_types = {col: pa.from_numpy_dtype(np.dtype(t)) for col, t in dtype.items()} if dtype else None
+    table = pa_csv.read_csv(
+        path,
+        read_options=pa_csv.ReadOptions(use_threads=True),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(usecols), column_types=column_types)
+    )
+    return table.to_pandas()
+
+
 def write_df_file(df: pd.DataFrame, path: str, columns: list = None, overwrite: bool = False, **kwargs) -> bool:
     """
-    Write a DF into a file. Supported formats are: parquet, csv, xlsx
+    Write a DF into a file. Supported formats are: parquet, csv, csv.gz, xlsx.
+    Parquet files are written with pyarrow and snappy compression (in row groups of PARQUET_ROW_GROUP_SIZE rows),
+    csv.gz files with fast (level 1) gzip compression, unless specified otherwise in `kwargs`.
 
     Args:
         df: Dataframe to write
@@ -57,12 +98,20 @@ def write_df_file(df: pd.DataFrame, path: str, columns: list = None, overwrite:
 
     if path.endswith('csv'):
         df.to_csv(path, index=False, **kwargs)
+    elif path.endswith('csv.gz'):
+        kwargs.setdefault('compression', {'method': 'gzip', 'compresslevel': 1})
+        df.to_csv(path, index=False, **kwargs)
     elif path.endswith('parquet'):
+        kwargs.setdefault('engine', 'pyarrow')
+        kwargs.setdefault('compression', 'snappy')
+        # extra kwargs of `to_parquet` are passed to pyarrow.parquet.write_table
+        if kwargs['engine'] == 'pyarrow':
+            kwargs.setdefault('row_group_size', PARQUET_ROW_GROUP_SIZE)
         df.to_parquet(path, index=False, **kwargs)
     elif path.endswith('xlsx') or path.endswith('xls'):
         df.to_excel(path, index=False, **kwargs)
     else:
-        raise ValueError('only supports parquet, csv, xlsx')
+        raise ValueError('only supports parquet, csv, csv.gz, xlsx')
     return True
 
 
@@ -82,12 +131,11 @@ def interpolate_numeric_df(df: pd.DataFrame, timestamp_col: str, new_timestamp:
 
     df_value = df[cols_except_ts].to_numpy()
     df_timestamp = df[timestamp_col].to_numpy()
+    new_value = interpolate_numeric_array(df_timestamp, df_value, new_timestamp)
 
-    new_df = {timestamp_col: new_timestamp}
-    for i, col in enumerate(cols_except_ts):
-        new_df[col] = np.interp(x=new_timestamp, xp=df_timestamp, fp=df_value[:, i])
-
-    new_df = pd.DataFrame(new_df)
+    # wrap the interpolated array without copying it column by column
+    new_df = pd.DataFrame(new_value, columns=cols_except_ts, copy=False)
+    new_df.insert(loc=0, column=timestamp_col, value=new_timestamp)
     return new_df
 
 
@@ -110,7 +158,11 @@ def down_sample_df(df: pd.DataFrame, down_sample_by: int) -> pd.DataFrame:
     if num_row == len(df):
         return df
 
-    keep_idx = np.linspace(0, len(df) - 1, num_row, endpoint=True)
-    df = df.iloc[keep_idx]
-    df = df.reset_index(drop=True)
+    keep_idx = np.linspace(0, len(df) - 1, num_row, endpoint=True).astype(np.int64)
+    if df.columns.is_unique and all(isinstance(dtype, np.dtype) for dtype in df.dtypes):
+        # plain numpy columns (the usual case for sensor data): take rows from the arrays directly
+        df = pd.DataFrame({col: df[col].to_numpy()[keep_idx] for col in df.columns}, copy=False)
+    else:
+        df = df.iloc[keep_idx]
+        df = df.reset_index(drop=True)
     return df
@@ -21,24 +21,65 @@ def interval_intersection(intervals: List[List[List[int]]]) -> List[List[int]]:
     if len(intervals) == 1:
         return intervals[0]
 
-    # index indicating current position for each interval list
-    pos_indices = np.zeros(len(intervals), dtype=int)
-    # lengths of all ranges
-    all_len = np.array([len(interval) for interval in intervals])
-
-    result = []
-    while np.all(pos_indices < all_len):
-        # the startpoint of the intersection
-        lo = max([intervals[interval_idx][pos_idx][0] for interval_idx, pos_idx in enumerate(pos_indices)])
-        # the endpoint of the intersection
-        endpoints = [intervals[interval_idx][pos_idx][1] for interval_idx, pos_idx in enumerate(pos_indices)]
-        hi = min(endpoints)
-
-        # save result if there is an intersection among segments
-        if lo < hi:
-            result.append([lo, hi])
-
-        # remove the interval with the smallest endpoint
-        pos_indices[np.argmin(endpoints)] += 1
-
-    return result
+    # sweep line over all segment endpoints: +1 at a start, -1 at an end
+    segments = np.array([segment for interval in intervals for segment in interval]).reshape([-1, 2])
+    num_segments = len(segments)
+    points = np.concatenate([segments[:, 0], segments[:, 1]])
+    deltas = np.concatenate([np.ones(num_segments, dtype=int), np.full(num_segments, -1, dtype=int)])
+    # sort by timestamp, ends come before starts at the same timestamp so touching segments don't intersect
+    order = np.lexsort((deltas, points))
+    points = points[order]
+    num_active = np.cumsum(deltas[order])
+
+    # an intersection starts where all timeseries are active and ends at the next point (which must be an end)
+    start_idx = np.nonzero(num_active == len(intervals))[0]
+    result = np.stack([points[start_idx], points[start_idx + 1]], axis=1)
+    # save result if there is an intersection among segments
+    result = result[result[:, 0] < result[:, 1]]
+    return result.tolist()
+
+
+def interpolate_numeric_array(timestamp: np.ndarray, values: np.ndarray, new_timestamp: np.ndarray,
+                              out: np.ndarray = None) -> np.ndarray:
+    """
+    Interpolate a 2D array linearly along its first axis. Same result as calling `np.interp` for each column, but
+    the search for neighbour timestamps and the interpolation weights are computed only once for all columns.
+    Values outside the range of `timestamp` are clamped to the first/last value (like `np.interp`).
+
+    Args:
+        timestamp: 1D array of original timestamps (sorted ascending), shape [N]
+        values: 2D array of values, shape [N, number of channels]
+        new_timestamp: array of evaluated timestamps, shape [M]
+        out: optional float array to write the result into, shape [M, number of channels];
+            it can be a column slice of a bigger array
+
+    Returns:
+        an interpolated float array, shape [M, number of channels] (this is `out` if provided)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if out is None:
+        out = np.empty([len(new_timestamp), values.shape[1]], dtype=np.float64)
+    # no interpolation needed if data is already on the new timestamps (lengths are compared first, so this is cheap),
+    # except when timestamps are duplicated (`np.interp` then takes the last value of the duplicates)
+    if len(timestamp) == 1 or (np.array_equal(timestamp, new_timestamp) and np.all(np.diff(timestamp) > 0)):
+        out[:] = values
+        return out
+
+    # index of the left neighbour of each new timestamp
+    left_idx = np.searchsorted(timestamp, new_timestamp, side='right') - 1
+    np.clip(left_idx, 0, len(timestamp) - 2, out=left_idx)
+    left_ts = timestamp[left_idx]
+    gap = timestamp[left_idx + 1] - left_ts
+
+    # slope * distance to left neighbour + left value, the same arithmetic as `np.interp`, so results are identical
+    # (zero gaps only happen at the 2 ends when timestamps are duplicated, those rows are overwritten below)
+    left_values = values[left_idx]
+    np.subtract(values[left_idx + 1], left_values, out=out)
+    np.divide(out, gap[:, np.newaxis], out=out, where=(gap != 0)[:, np.newaxis])
+    out *= (new_timestamp - left_ts)[:, np.newaxis]
+    out += left_values
+
+    # values are clamped to the first/last value for new timestamps out of range
+    out[new_timestamp < timestamp[0]] = values[0]
+    out[new_timestamp >= timestamp[-1]] = values[-1]
+    return out
@@ -1,4 +1,5 @@
 import os
+from typing import List, Tuple
 from loguru import logger
 
 
@@ -43,7 +44,8 @@ def write_text_file(content: str, path: str, overwrite: bool = False) -> bool:
 
 def read_last_line(path: str) -> str:
     """
-    Read only that last line of a text file
+    Read only that last line of a text file. The line break is searched in a block at the end of the file
+    (see `read_head_and_tail`), instead of reading backward byte by byte.
 
     Args:
         path: path to file
@@ -51,12 +53,36 @@ def read_last_line(path: str) -> str:
     Returns:
         the last line of file
     """
+    _, last_line = read_head_and_tail(path, num_head_lines=0)
+    return last_line.decode()
+
+
+def read_head_and_tail(path: str, num_head_lines: int = 1, tail_bytes: int = 4096) -> Tuple[List[bytes], bytes]:
+    """
+    Read the first lines and the last line of a text file with a single open. Only a small block at the end of the
+    file is read to find the last line (the block is enlarged if the last line is longer than it).
+    Lines are returned as bytes (with line break) to avoid decoding.
+
+    Args:
+        path: path to file
+        num_head_lines: number of lines to read from the beginning of the file
+        tail_bytes: initial number of bytes to read from the end of the file
+
+    Returns:
+        a tuple of 2 elements: list of the first lines, the last line
+    """
     with open(path, 'rb') as f:
-        try:  # catch OSError in case of a one line file
-            f.seek(-2, os.SEEK_END)
-            while f.read(1) != b'\n':
-                f.seek(-2, os.SEEK_CUR)
-        except OSError:
-            f.seek(0)
-        last_line = f.readline().decode()
-    return last_line
+        head_lines = [f.readline() for _ in range(num_head_lines)]
+
+        file_size = f.seek(0, os.SEEK_END)
+        while True:
+            tail_start = max(file_size - tail_bytes, 0)
+            f.seek(tail_start)
+            tail = f.read()
+            # skip the last character (line break at the end of file)
+            line_start = tail.rfind(b'\n', 0, len(tail) - 1) + 1
+            if line_start > 0 or tail_start == 0:
+                break
+            tail_bytes *= 2
+
+    return head_lines, tail[line_start:]
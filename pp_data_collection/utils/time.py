@@ -1,5 +1,9 @@
 import time
-from datetime import datetime, timezone
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+_EPOCH = datetime(1970, 1, 1)
 
 
 def datetime_2_timestamp(dt: datetime, tz: int = 7) -> int:
@@ -13,11 +17,27 @@ def datetime_2_timestamp(dt: datetime, tz: int = 7) -> int:
     Returns:
         timestamp in millisecond
     """
-    dt = dt.replace(tzinfo=timezone.utc)
-    timestamp = dt.timestamp() - tz * 3600
+    # tzinfo (if any) is ignored, the datetime is considered to be in timezone `tz`
+    timestamp = (dt.replace(tzinfo=None) - _EPOCH).total_seconds() - tz * 3600
     return round(timestamp * 1000)
 
 
+def datetimes_2_timestamps(dts: any, tz: int = 7) -> np.ndarray:
+    """
+    Convert many datetime values to timestamps at once. Same result as calling `datetime_2_timestamp` for each item,
+    except that values of exactly half a millisecond are always rounded up (integer arithmetic, no float rounding).
+
+    Args:
+        dts: an array-like of datetime values (datetime objects, numpy datetime64, pandas Series, etc.) without timezone
+        tz: timezone of the datetime values
+
+    Returns:
+        an int64 numpy array of timestamps in millisecond
+    """
+    nanosec = pd.DatetimeIndex(dts).as_unit('ns').asi8
+    return (nanosec + 500_000) // 1_000_000 - tz * 3_600_000
+
+
 def str_2_timestamp(str_time: str, str_format: str = '%Y/%m/%d %H:%M:%S', tz: int = 7) -> int:
     """
     Convert datetime as string to timestamp (msec)
@@ -81,7 +101,8 @@ class TimeThis:
         self.printer_kwargs = kwargs
 
     def __enter__(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.printer(f'Elapsed time for {self.op_name}: {time.time() - self.start_time}(s)', **self.printer_kwargs)
+        self.printer(f'Elapsed time for {self.op_name}: {time.perf_counter() - self.start_time}(s)',
+                     **self.printer_kwargs)
@@ -1,6 +1,10 @@
+import os
 import subprocess
 import json
-from moviepy.tools import subprocess_call as moviepy_subprocess_call
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Union, List, Iterator, Tuple
 
 
 def ffmpeg_cut_video(input_path: str, output_path: str, start_sec: float = None, end_sec: float = None,
@@ -13,46 +17,220 @@ def ffmpeg_cut_video(input_path: str, output_path: str, start_sec: float = None,
         start_sec: start second
         end_sec: end second
         output_path: path to save new video
-        video_codec: video codec, default is h264 because 'copy' codec may mess up the metadata
+        video_codec: video codec, default is h264 because 'copy' codec may mess up the metadata and can only cut at
+            keyframes; 'copy' is much faster but the output may start up to 1 keyframe interval before start_sec
     """
+    # imported here because moviepy is slow to import and only needed for cutting videos
+    from moviepy.tools import subprocess_call as moviepy_subprocess_call
+
     assert start_sec or end_sec, "No start/end time provided!"
     if start_sec is None:
         start_sec = 0
 
-    cmd = ["ffmpeg", "-y", "-i", input_path]
+    cmd = ["ffmpeg", "-y"]
 
+    # seek on input side so ffmpeg jumps to the nearest keyframe instead of decoding everything before start_sec;
+    # because the video is re-encoded, the cut is still frame-accurate
     if start_sec:
         cmd += ["-ss", "%0.2f" % start_sec]
+    cmd += ["-i", input_path]
     if end_sec:
         cmd += ["-t", "%0.2f" % (end_sec - start_sec)]
 
-    cmd += ["-map", "0", "-vcodec", video_codec, "-an", output_path]
+    cmd += ["-map", "0", "-vcodec", video_codec, "-an"]
+    # without re-encoding, the cut starts at the keyframe before start_sec, shift timestamps so the output starts at 0
+    if video_codec == 'copy':
+        cmd += ["-avoid_negative_ts", "make_zero"]
+    cmd += [output_path]
 
     moviepy_subprocess_call(cmd)
 
 
 def get_video_metadata(path: str) -> dict:
     """
-    Get video metadata
+    Get video metadata. Results are cached until the file is modified, so each video is probed by ffprobe only once.
+
+    Args:
+        path: path to video
+
+    Returns:
+        a dictionary with keys: length, fps, num_frames
+    """
+    return dict(_probe_video_metadata(path, os.path.getmtime(path)))
+
+
+def get_video_metadata_batch(paths: List[str], num_workers: int = 8) -> List[dict]:
+    """
+    Get metadata of many videos. ffprobe processes run concurrently, threads are enough because they only wait for
+    the subprocesses.
+
+    Args:
+        paths: list of paths to videos
+        num_workers: max number of ffprobe processes running at the same time
+
+    Returns:
+        a list of dictionaries (same order as `paths`) with keys: length, fps, num_frames
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(get_video_metadata, paths))
+
+
+@lru_cache(maxsize=1024)
+def _probe_video_metadata(path: str, mtime: float) -> dict:
+    """
+    Run ffprobe to get video metadata. Modification time is only used as a cache key.
 
     Args:
         path: path to video
+        mtime: modification time of the video file
 
     Returns:
         a dictionary with keys: length, fps, num_frames
     """
-    result = subprocess.check_output(
-        f'ffprobe -v quiet -show_streams -select_streams v:0 -of json "{path}"',
-        shell=True).decode()
+    # run without a shell, so the path doesn't need quoting
+    result = subprocess.run(
+        ['ffprobe', '-v', 'quiet', '-show_streams', '-select_streams', 'v:0', '-of', 'json', path],
+        capture_output=True, check=True).stdout
     fields = json.loads(result)['streams'][0]
+    # frame rate is a fraction string, e.g. '30000/1001'
+    fps_num, fps_den = fields['r_frame_rate'].split('/')
 
     return {
         'length': float(fields['duration']),
-        'fps': eval(fields['r_frame_rate']),
+        'fps': int(fps_num) / int(fps_den),
         'num_frames': int(fields['nb_frames'])
     }
 
 
+def _iter_mp4_atoms(f, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Iterate over the atoms of an MP4 file between 2 byte positions (the content of a parent atom, or the whole file).
+    Atoms are walked by their size headers, their contents are not read.
+
+    Args:
+        f: file object opened in binary mode
+        start: byte position of the first atom
+        end: byte position where the parent atom ends
+
+    Yields:
+        tuples of 3 elements: atom type, byte position of atom content, byte position where the atom ends
+    """
+    atom_start = start
+    while atom_start + 8 <= end:
+        f.seek(atom_start)
+        atom_size, atom_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        # 64-bit atom size
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        # atom extends to the end of its parent
+        elif atom_size == 0:
+            atom_size = end - atom_start
+        if atom_size < header_size:
+            return
+        yield atom_type, atom_start + header_size, atom_start + atom_size
+        atom_start += atom_size
+
+
+def _find_mp4_atom(f, start: int, end: int, target: bytes) -> Union[Tuple[int, int], None]:
+    """
+    Find the first atom of a type among the atoms between 2 byte positions of an MP4 file.
+
+    Args:
+        f: file object opened in binary mode
+        start: byte position of the first atom
+        end: byte position where the parent atom ends
+        target: atom type to find
+
+    Returns:
+        a tuple of 2 elements: byte position of atom content, byte position where the atom ends; None if not found
+    """
+    for atom_type, content_start, atom_end in _iter_mp4_atoms(f, start, end):
+        if atom_type == target:
+            return content_start, atom_end
+    return None
+
+
+def _fast_mp4_duration(path: str) -> Union[float, None]:
+    """
+    Read video stream duration directly from the 'mdhd' atom of the video track ('trak' atom whose 'hdlr' type is
+    'vide') of an MP4 file. This is the same value as the stream duration given by ffprobe, not the movie duration in
+    'mvhd', which also covers other tracks (e.g. audio).
+    Atoms are walked by their size headers and skipped with `seek`, so only a few bytes of the file are read.
+
+    Args:
+        path: path to video
+
+    Returns:
+        duration in second, None if the file is not a parsable MP4 or not a simple case (not exactly 1 video track,
+        the video track has an edit list, which ffprobe takes into account, or its duration is 0 or unknown)
+    """
+    with open(path, 'rb') as f:
+        file_end = f.seek(0, 2)
+        moov = _find_mp4_atom(f, 0, file_end, b'moov')
+        if moov is None:
+            return None
+
+        # media header of the video track(s)
+        video_mdhds = []
+        for atom_type, trak_start, trak_end in _iter_mp4_atoms(f, *moov):
+            if atom_type != b'trak':
+                continue
+            mdia = _find_mp4_atom(f, trak_start, trak_end, b'mdia')
+            if mdia is None:
+                return None
+            hdlr = _find_mp4_atom(f, *mdia, b'hdlr')
+            if hdlr is None:
+                return None
+            # version & flags (4), pre-defined (4), handler type (4)
+            f.seek(hdlr[0] + 8)
+            if f.read(4) != b'vide':
+                continue
+            if _find_mp4_atom(f, trak_start, trak_end, b'edts') is not None:
+                return None
+            mdhd = _find_mp4_atom(f, *mdia, b'mdhd')
+            if mdhd is None:
+                return None
+            video_mdhds.append(mdhd)
+
+        if len(video_mdhds) != 1:
+            return None
+        f.seek(video_mdhds[0][0])
+        version = f.read(4)[0]
+        if version == 1:
+            # creation time (8), modification time (8), timescale (4), duration (8)
+            timescale, duration = struct.unpack('>16xIQ', f.read(28))
+        else:
+            # creation time (4), modification time (4), timescale (4), duration (4)
+            timescale, duration = struct.unpack('>8xII', f.read(16))
+
+    # duration 0 (e.g. fragmented MP4) and all-ones (unknown, 32 or 64 bit) are not real durations
+    if timescale == 0 or duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        return None
+    return duration / timescale
+
+
+def get_video_duration(path: str) -> float:
+    """
+    Get video duration. MP4 header is parsed directly; ffprobe is only used if that fails.
+
+    Args:
+        path: path to video
+
+    Returns:
+        duration in second
+    """
+    try:
+        duration = _fast_mp4_duration(path)
+    except (OSError, struct.error, IndexError):
+        duration = None
+
+    if duration is None:
+        duration = get_video_metadata(path)['length']
+    return duration
+
+
 # opencv-python == 4.5.5.64
 # import numpy as np
 # from typing import Tuple
@@ -12,6 +12,7 @@ if __name__ == '__main__':
         device_config_file='../config/cfg.yaml',
         log_file=f'{root}/Collection log.xlsx',
         raw_data_folder=f'{root}/raw',
-        processed_data_folder=f'{root}/processed'
+        processed_data_folder=f'{root}/processed',
+        num_workers=4
     )
     task.run()